@@ -0,0 +1,62 @@
+# rerank.py
+# Exact cosine top-k re-ranking over the candidate vectors returned by an
+# ANN search. With the IVF_PQ index, quality is restored by pulling
+# k * refine_factor candidates and re-scoring them against the query with
+# exact distances; this module provides that kernel. Backends, best first:
+# simsimd (hand-tuned AVX-512/NEON kernels), a numba JIT-compiled parallel
+# loop, then a vectorized NumPy fallback.
+
+import numpy as np
+
+try:
+    import simsimd
+    HAVE_SIMSIMD = True
+except ImportError:
+    HAVE_SIMSIMD = False
+
+try:
+    from numba import njit, prange
+    HAVE_NUMBA = True
+except ImportError:
+    HAVE_NUMBA = False
+
+if HAVE_NUMBA:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _cosine_scores(q, mat):
+        n = mat.shape[0]
+        out = np.empty(n, dtype=np.float32)
+        # Accumulate the query norm by hand: np.dot in nopython mode lowers
+        # through BLAS, which numba only has when scipy is installed.
+        q_sq = 0.0
+        for j in range(q.shape[0]):
+            q_sq += q[j] * q[j]
+        q_norm = np.sqrt(q_sq)
+        for i in prange(n):
+            dot = 0.0
+            norm = 0.0
+            for j in range(mat.shape[1]):
+                dot += q[j] * mat[i, j]
+                norm += mat[i, j] * mat[i, j]
+            out[i] = dot / (np.sqrt(norm) * q_norm + 1e-12)
+        return out
+else:
+    def _cosine_scores(q, mat):
+        norms = np.linalg.norm(mat, axis=1) * np.linalg.norm(q)
+        return (mat @ q) / (norms + 1e-12)
+
+
+def cosine_topk(query, mat, k: int) -> np.ndarray:
+    """Return the indices of the k rows of mat most cosine-similar to query,
+    best first. mat must be a contiguous (N, D) array; float16 rows are fine
+    since everything is cast up to float32 before scoring."""
+    q = np.ascontiguousarray(query, dtype=np.float32)
+    m = np.ascontiguousarray(mat, dtype=np.float32)
+    if HAVE_SIMSIMD:
+        # cdist returns distances; flip to similarities so ordering matches.
+        dists = np.asarray(simsimd.cdist(q[None, :], m, metric="cosine"), dtype=np.float32)
+        scores = 1.0 - dists.ravel()
+    else:
+        scores = _cosine_scores(q, m)
+    k = min(k, len(scores))
+    top = np.argpartition(scores, -k)[-k:]
+    return top[np.argsort(scores[top])[::-1]]